@@ -0,0 +1,47 @@
+import time
+import numpy as np
+import librosa
+from slowdowner.audio import slow_down_audio, slow_down_and_transpose, analyze_audio
+
+SR = 44100
+DURATION = 20.0
+SLOWDOWN_FACTOR = 1.5
+SEMITONES = -2.0
+REPEATS = 3
+
+
+def best_time(func):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    for channels in (1, 2):
+        shape = (int(SR * DURATION),) if channels == 1 else (channels, int(SR * DURATION))
+        y = (0.1 * rng.standard_normal(shape)).astype(np.float32)
+        stft_matrix = analyze_audio(y)
+
+        chained = best_time(lambda: librosa.effects.pitch_shift(slow_down_audio(y, SLOWDOWN_FACTOR),
+                                                                sr=SR, n_steps=SEMITONES))
+        combined = best_time(lambda: slow_down_and_transpose(y, SR, SLOWDOWN_FACTOR, SEMITONES))
+        cached = best_time(lambda: slow_down_and_transpose(y, SR, SLOWDOWN_FACTOR, SEMITONES,
+                                                           stft_matrix=stft_matrix))
+
+        print(f"{channels} channel(s), {DURATION:.0f} s at {SR} Hz:")
+        print(f"  chained slow_down_audio + pitch_shift: {chained:.3f} s")
+        print(f"  slow_down_and_transpose:               {combined:.3f} s ({chained / combined:.2f}x faster)")
+        print(f"  slow_down_and_transpose, cached STFT:  {cached:.3f} s ({chained / cached:.2f}x faster)")
+
+    # The apps render through slow_down_and_transpose; compare downmixed mono with native stereo
+    stereo = (0.1 * rng.standard_normal((2, int(SR * DURATION)))).astype(np.float32)
+    mono = librosa.to_mono(stereo)
+    for semitones in (0.0, SEMITONES):
+        mono_time = best_time(lambda: slow_down_and_transpose(mono, SR, SLOWDOWN_FACTOR, semitones))
+        stereo_time = best_time(lambda: slow_down_and_transpose(stereo, SR, SLOWDOWN_FACTOR, semitones))
+        print(f"slow_down_and_transpose at {semitones:+.0f} semitones: mono {mono_time:.3f} s, "
+              f"stereo {stereo_time:.3f} s ({stereo_time / mono_time:.2f}x mono)")
@@ -1,47 +1,68 @@
 import os
+import io
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
 import numpy as np
 import librosa
-import sounddevice as sd
+import soundfile as sf
 import moviepy as mp
 
+N_FFT = 2048
+HOP_LENGTH = N_FFT // 4
 
-def extract_audio_from_video(video_path:str, save_flag:bool=False, output_path:str=None):
+AUDIO_FORMATS = {"wav": ("WAV", "audio/wav"), "flac": ("FLAC", "audio/flac"), "ogg": ("OGG", "audio/ogg")}
+ENCODE_CACHE_BYTES = 256 * 1024 ** 2  # memory kept for encoded segments
+
+# Encoded segments keyed by (render key, format); shared by all threads (e.g. Streamlit sessions) of the process
+_encode_cache = OrderedDict()
+_encode_cache_lock = threading.Lock()
+
+
+def extract_audio_from_video(video_path:str, save_flag:bool=False, output_path:str=None, mono:bool=False):
     """
     Extracts the audio track from a video and returns it as a NumPy array with sample rate.
 
     :param str video_path: Path to the input video file.
     :param bool save_flag: If True, saves the extracted audio to output_path.
     :param str output_path: Path to save the extracted audio file (if save_flag is True).
+    :param bool mono: If True, downmixes to mono (faster to process); otherwise keeps the native channels.
 
-    :return: Tuple (audio_array, sample_rate) where audio_array is a NumPy array of the audio samples
-             and sample_rate is the sample rate of the audio.
+    :return: Tuple (audio_array, sample_rate) where audio_array is a NumPy array of the audio samples,
+             shaped (channels, samples) for multichannel audio, and sample_rate is the sample rate of the audio.
     """
     print(f"Extracting audio from {video_path}...")
-    temp_audio_path = "temp_extracted_audio.wav"
     video = mp.VideoFileClip(video_path)
     if save_flag:
         if output_path is None:
             raise ValueError("Output path must be provided if save_flag is True.")
         video.audio.write_audiofile(output_path)  # removed verbose/logger
-        y, sr = librosa.load(output_path, sr=None)
+        y, sr = librosa.load(output_path, sr=None, mono=mono)
     else:
-        video.audio.write_audiofile(temp_audio_path)  # removed verbose/logger
-        y, sr = librosa.load(temp_audio_path, sr=None)
-        os.remove(temp_audio_path)
+        # Unique temporary file, so concurrent extractions never share one
+        fd, temp_audio_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            video.audio.write_audiofile(temp_audio_path)  # removed verbose/logger
+            y, sr = librosa.load(temp_audio_path, sr=None, mono=mono)
+        finally:
+            os.remove(temp_audio_path)
     return y, sr
 
 
-def load_audio(audio_path:str):
+def load_audio(audio_path:str, mono:bool=False):
     """
     Loads an audio file (wav, mp3, etc.) and returns it as a NumPy array with sample rate.
 
     :param str audio_path: Path to the audio file.
+    :param bool mono: If True, downmixes to mono (faster to process); otherwise keeps the native channels.
 
-    :return: Tuple (audio_array, sample_rate) where audio_array is a NumPy array of the audio samples
-             and sample_rate is the sample rate of the audio.
+    :return: Tuple (audio_array, sample_rate) where audio_array is a NumPy array of the audio samples,
+             shaped (channels, samples) for multichannel audio, and sample_rate is the sample rate of the audio.
     """
     print(f"Loading audio from {audio_path}...")
-    y, sr = librosa.load(audio_path, sr=None)
+    y, sr = librosa.load(audio_path, sr=None, mono=mono)
     return y, sr
 
 
@@ -49,23 +70,36 @@ def extract_time_window(audio_array: np.ndarray, sr: int, start_time: float, end
     """
     Extracts a portion of the audio trace between start_time and end_time (in seconds).
 
-    :param np.ndarray audio_array: The audio samples as a NumPy array.
+    :param np.ndarray audio_array: The audio samples as a NumPy array (samples on the last axis).
     :param int sr: The sample rate of the audio.
     :param float start_time: Start time in seconds.
     :param float end_time: End time in seconds.
 
-    :return: NumPy array containing the extracted audio segment.
+    :return: NumPy array containing the extracted audio segment, with the same channel layout.
     """
     start_sample = int(start_time * sr)
     end_sample = int(end_time * sr)
-    return audio_array[start_sample:end_sample]
+    return audio_array[..., start_sample:end_sample]
+
+
+def audio_duration(audio_array: np.ndarray, sr: int) -> float:
+    """
+    Returns the duration of an audio array in seconds, for mono or multichannel audio.
+
+    :param np.ndarray audio_array: The audio samples as a NumPy array (samples on the last axis).
+    :param int sr: The sample rate of the audio.
+
+    :return: Duration in seconds.
+    """
+    return audio_array.shape[-1] / sr
 
 
 def slow_down_audio(audio_segment: np.ndarray, slowdown_factor: float) -> np.ndarray:
     """
     Slows down an audio segment without changing its pitch using librosa.
+    All channels of a multichannel segment are stretched together in one batched call.
 
-    :param np.ndarray audio_segment: The audio segment to slow down.
+    :param np.ndarray audio_segment: The audio segment to slow down, mono or shaped (channels, samples).
     :param float slowdown_factor: The factor by which to slow down the audio (e.g., 2.0 halves the speed).
 
     :return: NumPy array of the slowed down audio segment.
@@ -74,6 +108,120 @@ def slow_down_audio(audio_segment: np.ndarray, slowdown_factor: float) -> np.nda
     return librosa.effects.time_stretch(audio_segment, rate=1.0 / slowdown_factor)
 
 
+def file_fingerprint(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes a content fingerprint of a file, used to recognise a source across sessions.
+
+    :param str file_path: Path to the file.
+    :param int chunk_size: Number of bytes read at a time.
+
+    :return: Hex SHA-256 digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_key(fingerprint: str, start_time: float, end_time: float, slowdown_factor: float,
+               mono: bool = False, semitones: float = 0.0) -> str:
+    """
+    Builds the cache key of a rendered segment from the source fingerprint and render parameters.
+
+    :param str fingerprint: Fingerprint of the source (see file_fingerprint).
+    :param float start_time: Start time in seconds.
+    :param float end_time: End time in seconds.
+    :param float slowdown_factor: The slowdown factor applied to the segment.
+    :param bool mono: Whether the source was downmixed to mono.
+    :param float semitones: The pitch shift applied to the segment, in semitones.
+
+    :return: Hex digest identifying the rendered segment.
+    """
+    params = (f"{fingerprint}:{start_time:.3f}:{end_time:.3f}:{slowdown_factor:.4f}:"
+              f"{'mono' if mono else 'native'}:{semitones:.3f}")
+    return hashlib.sha1(params.encode()).hexdigest()
+
+
+def analyze_audio(audio_segment: np.ndarray) -> np.ndarray:
+    """
+    Computes the STFT analysis used by slow_down_and_transpose. It depends only on the segment,
+    so it can be cached and reused across different slowdown factors and transpositions.
+
+    :param np.ndarray audio_segment: The audio segment, mono or shaped (channels, samples).
+
+    :return: Complex STFT matrix shaped (..., frequency bins, frames).
+    """
+    return librosa.stft(audio_segment, n_fft=N_FFT, hop_length=HOP_LENGTH)
+
+
+def slow_down_and_transpose(audio_segment: np.ndarray, sr: int, slowdown_factor: float, semitones: float = 0.0,
+                            stft_matrix: np.ndarray = None) -> np.ndarray:
+    """
+    Slows down an audio segment and shifts its pitch by a number of semitones in a single
+    STFT analysis/synthesis pass, instead of chaining slow_down_audio and librosa.effects.pitch_shift.
+    The segment is stretched by slowdown_factor times the pitch ratio, then resampled once by the pitch ratio.
+
+    :param np.ndarray audio_segment: The audio segment, mono or shaped (channels, samples).
+    :param int sr: The sample rate of the audio.
+    :param float slowdown_factor: The factor by which to slow down the audio (e.g., 2.0 halves the speed).
+    :param float semitones: Pitch shift in semitones (positive shifts up, negative shifts down).
+    :param np.ndarray stft_matrix: Precomputed analysis of audio_segment (see analyze_audio), computed if None.
+
+    :return: NumPy array of the processed audio segment.
+    """
+    print(f"Slowing down audio by a factor of {slowdown_factor} and transposing by {semitones} semitones...")
+    pitch_ratio = 2.0 ** (semitones / 12.0)
+    rate = 1.0 / (slowdown_factor * pitch_ratio)
+    if stft_matrix is None:
+        stft_matrix = analyze_audio(audio_segment)
+    n_samples = audio_segment.shape[-1]
+
+    stretched = librosa.phase_vocoder(stft_matrix, rate=rate, hop_length=HOP_LENGTH, n_fft=N_FFT)
+    y = librosa.istft(stretched, hop_length=HOP_LENGTH, n_fft=N_FFT, dtype=audio_segment.dtype,
+                      length=int(round(n_samples / rate)))
+    if semitones != 0:
+        y = librosa.resample(y, orig_sr=float(sr) * pitch_ratio, target_sr=sr)
+    return librosa.util.fix_length(y, size=int(round(n_samples * slowdown_factor)))
+
+
+def encode_audio(audio_array: np.ndarray, sr: int, audio_format: str = "wav", cache_key: str = None) -> bytes:
+    """
+    Encodes audio to WAV, FLAC or OGG (Vorbis) bytes entirely in memory.
+
+    :param np.ndarray audio_array: The audio samples, mono or shaped (channels, samples).
+    :param int sr: The sample rate of the audio.
+    :param str audio_format: One of "wav", "flac" or "ogg".
+    :param str cache_key: Render key of the audio (see render_key); if given, the encoded bytes are cached
+                          under (cache_key, audio_format) and reused by later calls.
+
+    :return: The encoded file contents as bytes.
+    """
+    audio_format = audio_format.lower()
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio format: {audio_format}. Choose from {', '.join(AUDIO_FORMATS)}.")
+    key = (cache_key, audio_format)
+    if cache_key is not None:
+        with _encode_cache_lock:
+            if key in _encode_cache:
+                _encode_cache.move_to_end(key)
+                return _encode_cache[key]
+
+    buffer = io.BytesIO()
+    # soundfile expects (frames, channels)
+    sf.write(buffer, np.asarray(audio_array).T, sr, format=AUDIO_FORMATS[audio_format][0])
+    data = buffer.getvalue()
+
+    if cache_key is not None and len(data) <= ENCODE_CACHE_BYTES:
+        with _encode_cache_lock:
+            _encode_cache[key] = data
+            total = sum(len(cached) for cached in _encode_cache.values())
+            while total > ENCODE_CACHE_BYTES:
+                _, evicted = _encode_cache.popitem(last=False)
+                total -= len(evicted)
+    return data
+
+
 def play_audio_loop(audio_array: np.ndarray, sr: int, nloops: int = 1) -> None:
     """
     Plays the given audio array in a loop for a specified number of times.
@@ -84,11 +232,14 @@ def play_audio_loop(audio_array: np.ndarray, sr: int, nloops: int = 1) -> None:
 
     :return: None
     """
+    # Imported here so the rest of the module works on hosts without PortAudio (e.g. a headless server)
+    import sounddevice as sd
+
     print("Playing slowed audio in loop. Press Ctrl+C to stop.")
     try:
         n = 1
         while n <= nloops:
-            sd.play(audio_array, sr)
+            sd.play(audio_array.T, sr)  # sounddevice expects (frames, channels)
             sd.wait()
             n += 1
     except KeyboardInterrupt:
@@ -5,7 +5,8 @@ import threading
 # import numpy as np
 # import librosa
 import sounddevice as sd
-from slowdowner.audio import load_audio, extract_audio_from_video, extract_time_window, slow_down_audio
+from slowdowner.audio import audio_duration
+from slowdowner.session import new_session, add_source, set_window, render_window, save_session, open_session
 
 
 class AudioSlowdownGUI:
@@ -18,16 +19,24 @@ class AudioSlowdownGUI:
         # Audio data
         self.audio_data = None
         self.sample_rate = None
+        self.playback_rate = None
+        self.cached_window = None
         self.audio_duration = 0
-        self.current_segment = None
         self.slowed_segment = None
         self.is_playing = False
         self.is_paused = False
         self.playback_thread = None
         self.current_loop = 0
         
+        # Practice session (sources, named loop windows and cached renders)
+        self.session = new_session()
+        self.session_path = None
+        self.source_id = None
+        self.source_audio = {}
+        
         # Create the GUI
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def create_widgets(self):
         # Main container with padding
@@ -56,6 +65,15 @@ class AudioSlowdownGUI:
                                    foreground='gray')
         self.file_label.grid(row=0, column=1, sticky=(tk.W, tk.E))
         
+        ttk.Button(file_frame, text="📂 Open Session", 
+                  command=self.open_session_file).grid(row=0, column=2, padx=(10, 0))
+        
+        self.mono_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(file_frame, text="Mono (faster processing)", 
+                       variable=self.mono_var).grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        ttk.Button(file_frame, text="💾 Save Session", 
+                  command=self.save_session_file).grid(row=0, column=3, padx=(10, 0))
+        
         # Time window section
         time_frame = ttk.LabelFrame(main_frame, text="Time Window", padding="10")
         time_frame.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
@@ -72,6 +90,12 @@ class AudioSlowdownGUI:
         self.end_entry = ttk.Entry(time_frame, textvariable=self.end_time_var, width=10)
         self.end_entry.grid(row=0, column=3, sticky=(tk.W, tk.E))
         
+        ttk.Label(time_frame, text="Loop Name:").grid(row=2, column=0, padx=(0, 5), pady=(10, 0))
+        self.window_name_var = tk.StringVar(value="Loop 1")
+        self.window_combo = ttk.Combobox(time_frame, textvariable=self.window_name_var, width=20)
+        self.window_combo.grid(row=2, column=1, columnspan=3, sticky=(tk.W, tk.E), pady=(10, 0))
+        self.window_combo.bind("<<ComboboxSelected>>", self.on_window_selected)
+        
         # Time position slider
         slider_frame = ttk.Frame(time_frame)
         slider_frame.grid(row=1, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=(10, 0))
@@ -103,6 +127,12 @@ class AudioSlowdownGUI:
         self.speed_entry.grid(row=0, column=1, sticky=tk.W)
         ttk.Label(speed_frame, text="(1.0 = normal speed, 2.0 = half speed)").grid(row=0, column=2, padx=(10, 0))
         
+        ttk.Label(speed_frame, text="Transpose (semitones):").grid(row=1, column=0, padx=(0, 10), pady=(5, 0))
+        self.semitones_var = tk.DoubleVar(value=0.0)
+        self.semitones_entry = ttk.Entry(speed_frame, textvariable=self.semitones_var, width=10)
+        self.semitones_entry.grid(row=1, column=1, sticky=tk.W, pady=(5, 0))
+        ttk.Label(speed_frame, text="(e.g. -2.0 = a whole tone down)").grid(row=1, column=2, padx=(10, 0), pady=(5, 0))
+        
         # Loop control
         loop_frame = ttk.Frame(control_frame)
         loop_frame.grid(row=1, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
@@ -164,33 +194,149 @@ class AudioSlowdownGUI:
                 self.status_label.config(text="Loading audio file...")
                 self.root.update()
                 
-                # Load audio
-                if file_path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
-                    self.audio_data, self.sample_rate = extract_audio_from_video(file_path)
-                else:
-                    self.audio_data, self.sample_rate = load_audio(file_path)
-                
-                self.audio_duration = len(self.audio_data) / self.sample_rate
-                
-                # Update UI
-                filename = os.path.basename(file_path)
-                self.file_label.config(text=f"{filename} ({self.audio_duration:.1f}s)", 
-                                     foreground='black')
+                # Load audio (and cache the decoded samples for later sessions)
+                sid, audio_data, sample_rate = add_source(self.session, file_path, mono=self.mono_var.get())
+                self.source_audio[sid] = (audio_data, sample_rate)
+                self.set_source(sid)
                 
                 # Update time controls
                 self.end_time_var.set(min(5.0, self.audio_duration))
-                self.position_scale.config(to=self.audio_duration)
-                self.update_position_label()
-                
-                # Enable controls
-                self.play_button.config(state='normal')
                 
+                filename = os.path.basename(file_path)
                 self.status_label.config(text=f"Audio loaded: {filename}")
                 
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load audio file:\n{str(e)}")
                 self.status_label.config(text="Error loading file")
     
+    def set_source(self, sid):
+        """Make a session source the current audio"""
+        self.source_id = sid
+        self.cached_window = None
+        self.audio_data, self.sample_rate = self.source_audio[sid]
+        self.audio_duration = audio_duration(self.audio_data, self.sample_rate)
+        
+        # Update UI
+        filename = self.session["sources"][sid]["name"]
+        self.file_label.config(text=f"{filename} ({self.audio_duration:.1f}s)", 
+                             foreground='black')
+        self.position_scale.config(to=self.audio_duration)
+        self.update_position_label()
+        
+        # Enable controls
+        self.play_button.config(state='normal')
+    
+    def apply_window(self, name):
+        """Load a named loop window into the controls"""
+        window = self.session["windows"][name]
+        self.cached_window = None
+        if window["source"] != self.source_id:
+            self.set_source(window["source"])
+        self.show_window(name)
+    
+    def show_window(self, name):
+        """Show the parameters of a named loop window in the controls"""
+        window = self.session["windows"][name]
+        self.window_name_var.set(name)
+        self.start_time_var.set(window["start"])
+        self.end_time_var.set(window["end"])
+        self.speed_var.set(window["factor"])
+        self.semitones_var.set(window.get("semitones", 0.0))
+    
+    def on_window_selected(self, event=None):
+        """Handle selection of a saved loop window"""
+        name = self.window_name_var.get()
+        if name in self.session["windows"]:
+            if self.session["windows"][name]["source"] not in self.source_audio:
+                if not self.use_cached_window(name):
+                    messagebox.showwarning("Missing Source", f"The audio of '{name}' could not be restored.")
+                return
+            self.apply_window(name)
+    
+    def use_cached_window(self, name):
+        """Select the cached render of a window whose source is missing; it plays as rendered"""
+        window = self.session["windows"][name]
+        try:
+            self.slowed_segment = render_window(
+                self.session, name, None, self.session["sources"][window["source"]]["sample_rate"]
+            )
+        except FileNotFoundError:
+            return False
+        self.cached_window = name
+        self.playback_rate = self.session["sources"][window["source"]]["sample_rate"]
+        self.show_window(name)
+        self.play_button.config(state='normal')
+        self.status_label.config(text=f"'{name}' restored from cache (source missing, parameters fixed)")
+        return True
+    
+    def open_session_file(self):
+        """Restore a saved practice session"""
+        file_path = filedialog.askopenfilename(
+            title="Open Practice Session",
+            filetypes=[("Session files", "*.json"), ("All files", "*.*")]
+        )
+        
+        if file_path:
+            try:
+                self.stop_audio()
+                self.status_label.config(text="Opening session...")
+                self.root.update()
+                
+                self.session, self.source_audio = open_session(file_path)
+                self.session_path = file_path
+                self.window_combo.config(values=list(self.session["windows"]))
+                
+                self.cached_window = None
+                active = self.session["windows"].get(self.session["active_window"])
+                if active is not None and active["source"] in self.source_audio:
+                    self.apply_window(self.session["active_window"])
+                elif active is not None and self.use_cached_window(self.session["active_window"]):
+                    pass
+                elif self.source_audio:
+                    self.set_source(next(iter(self.source_audio)))
+                else:
+                    self.source_id = None
+                    self.audio_data = None
+                    self.file_label.config(text="No file loaded", foreground='gray')
+                    self.play_button.config(state='disabled')
+                
+                self.status_label.config(text=f"Session opened: {os.path.basename(file_path)}")
+                
+                missing = [source["name"] for source in self.session["sources"].values() if source.get("missing")]
+                if missing:
+                    messagebox.showwarning("Missing Sources", 
+                                           "These sources could not be restored:\n" + "\n".join(missing))
+                
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to open session:\n{str(e)}")
+                self.status_label.config(text="Error opening session")
+    
+    def save_session_file(self):
+        """Save the practice session"""
+        file_path = filedialog.asksaveasfilename(
+            title="Save Practice Session",
+            defaultextension=".json",
+            filetypes=[("Session files", "*.json"), ("All files", "*.*")]
+        )
+        
+        if file_path:
+            try:
+                save_session(self.session, file_path)
+                self.session_path = file_path
+                self.status_label.config(text=f"Session saved: {os.path.basename(file_path)}")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save session:\n{str(e)}")
+    
+    def on_close(self):
+        """Save the session (if it has a file) and close the window"""
+        self.stop_audio()
+        if self.session_path is not None:
+            try:
+                save_session(self.session, self.session_path)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save session:\n{str(e)}")
+        self.root.destroy()
+    
     def on_time_change(self, *args):
         """Handle time window changes"""
         if self.audio_data is not None:
@@ -223,6 +369,9 @@ class AudioSlowdownGUI:
     
     def prepare_audio_segment(self):
         """Prepare the audio segment for playback"""
+        if self.cached_window is not None:
+            # Cached render of a missing source, already loaded by use_cached_window
+            return True
         if self.audio_data is None:
             return False
         
@@ -230,17 +379,18 @@ class AudioSlowdownGUI:
             start_time = self.start_time_var.get()
             end_time = self.end_time_var.get()
             slowdown_factor = self.speed_var.get()
+            semitones = self.semitones_var.get()
             
-            # Extract time window
-            self.current_segment = extract_time_window(
-                self.audio_data, self.sample_rate, start_time, end_time
-            )
+            window_name = self.window_name_var.get().strip() or "Loop 1"
             
-            # Apply slowdown
-            if slowdown_factor != 1.0:
-                self.slowed_segment = slow_down_audio(self.current_segment, slowdown_factor)
-            else:
-                self.slowed_segment = self.current_segment
+            # Extract time window, apply slowdown and transposition (reusing the cached render when parameters are unchanged)
+            set_window(self.session, window_name, self.source_id,
+                       start_time, end_time, slowdown_factor, semitones)
+            self.window_combo.config(values=list(self.session["windows"]))
+            self.slowed_segment = render_window(
+                self.session, window_name, self.audio_data, self.sample_rate
+            )
+            self.playback_rate = self.sample_rate
             
             return True
             
@@ -315,7 +465,7 @@ class AudioSlowdownGUI:
                     self.status_label.config(text=status_text)
                     
                     # Play audio
-                    sd.play(self.slowed_segment, self.sample_rate)
+                    sd.play(self.slowed_segment.T, self.playback_rate)  # sounddevice expects (frames, channels)
                     sd.wait()
                     
                     # Small delay between loops
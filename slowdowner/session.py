@@ -0,0 +1,392 @@
+import os
+import re
+import glob
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from slowdowner.audio import (load_audio, extract_audio_from_video, extract_time_window, analyze_audio,
+                              slow_down_and_transpose, file_fingerprint, render_key)
+
+SESSION_VERSION = 1
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "slowdowner")
+CACHE_SIZE_LIMIT = 2 * 1024 ** 3  # bytes of .npy buffers kept per cache directory
+ANALYSIS_CACHE_BYTES = 512 * 1024 ** 2  # memory kept for STFT analyses
+
+# In-memory STFT analyses of recently rendered windows, shared by all sessions (threads) of the process
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+def new_session(cache_dir: str = DEFAULT_CACHE_DIR) -> dict:
+    """
+    Creates an empty practice session whose decoded and rendered buffers are cached in cache_dir.
+    Least recently used buffers are evicted once the directory exceeds CACHE_SIZE_LIMIT.
+
+    :param str cache_dir: Directory holding the cached .npy buffers (shared between sessions by default).
+
+    :return: The session as a dictionary (sources, named loop windows and the active window).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    return {
+        "version": SESSION_VERSION,
+        "cache_dir": os.path.abspath(cache_dir),
+        "sources": {},
+        "windows": {},
+        "active_window": None,
+    }
+
+
+def _replace_atomically(path: str, write, mode: str = "wb") -> None:
+    # Write to a unique temporary file first so an interrupted save never leaves a truncated file
+    # behind and concurrent writers of the same path never share a temporary file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _evict_buffers(cache_dir: str, keep: str) -> None:
+    # Delete the least recently used buffers (oldest modification time, refreshed on every load)
+    # until the cache fits in CACHE_SIZE_LIMIT
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npy") and entry.path != keep:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= CACHE_SIZE_LIMIT:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def _save_buffer(path: str, array: np.ndarray) -> None:
+    _replace_atomically(path, lambda f: np.save(f, np.asarray(array)))
+    _evict_buffers(os.path.dirname(path), keep=path)
+
+
+def _cache_path(session: dict, name: str) -> str:
+    # Buffer names come from session files, so never let them point outside the cache directory
+    return os.path.join(session["cache_dir"], os.path.basename(name))
+
+
+def _load_buffer(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        audio_array = np.load(path, mmap_mode='r')
+        os.utime(path)  # mark as recently used
+        return audio_array
+    except (OSError, ValueError):
+        return None
+
+
+def source_id(fingerprint: str, mono: bool) -> str:
+    """
+    Returns the id of a source in a session. A file added with and without the mono downmix gives two
+    sources, so windows, renders and analyses of the two channel layouts never mix.
+
+    :param str fingerprint: Fingerprint of the source file (see file_fingerprint).
+    :param bool mono: Whether the source is downmixed to mono.
+
+    :return: The source id.
+    """
+    return f"{fingerprint}.{'mono' if mono else 'native'}"
+
+
+def _decoded_name(fingerprint: str, mono: bool, sr: int) -> str:
+    # The sample rate is part of the name so a cached buffer can be reused without any session metadata
+    return f"{source_id(fingerprint, mono)}.{int(sr)}hz.npy"
+
+
+def _find_decoded(cache_dir: str, fingerprint: str, mono: bool):
+    prefix = f"{source_id(fingerprint, mono)}."
+    for path in glob.glob(os.path.join(glob.escape(cache_dir), glob.escape(prefix) + "*hz.npy")):
+        match = re.fullmatch(r"(\d+)hz\.npy", os.path.basename(path)[len(prefix):])
+        if match is not None:
+            audio_array = _load_buffer(path)
+            if audio_array is not None:
+                return os.path.basename(path), audio_array, int(match.group(1))
+    return None, None, None
+
+
+def decode_source(file_path: str, mono: bool = False):
+    """
+    Decodes an audio or video file, picking the loader from the file extension.
+
+    :param str file_path: Path to the audio or video file.
+    :param bool mono: If True, downmixes to mono; otherwise keeps the native channels.
+
+    :return: Tuple (audio_array, sample_rate).
+    """
+    if file_path.lower().endswith(VIDEO_EXTENSIONS):
+        return extract_audio_from_video(file_path, mono=mono)
+    return load_audio(file_path, mono=mono)
+
+
+def add_source(session: dict, file_path: str, audio_array: np.ndarray = None, sr: int = None,
+               mono: bool = False, name: str = None, keep_path: bool = True):
+    """
+    Registers a source file in the session and caches its decoded samples on disk.
+
+    :param dict session: The session to update.
+    :param str file_path: Path to the audio or video file.
+    :param np.ndarray audio_array: Already decoded samples (decoded from file_path if None).
+    :param int sr: Sample rate of audio_array.
+    :param bool mono: If True, the source is downmixed to mono; otherwise keeps the native channels.
+    :param str name: Display name of the source (the file name by default).
+    :param bool keep_path: If False, file_path is not recorded (e.g. a temporary upload), so the source
+                           can only be restored from its cached buffer.
+
+    :return: Tuple (source_id, audio_array, sample_rate).
+    """
+    fingerprint = file_fingerprint(file_path)
+    decoded_name, cached, cached_sr = _find_decoded(session["cache_dir"], fingerprint, mono)
+    if audio_array is None and cached is not None:
+        audio_array, sr = cached, cached_sr
+    else:
+        if audio_array is None:
+            audio_array, sr = decode_source(file_path, mono=mono)
+        if cached is None or cached_sr != sr:
+            decoded_name = _decoded_name(fingerprint, mono, sr)
+            _save_buffer(_cache_path(session, decoded_name), audio_array)
+    sid = source_id(fingerprint, mono)
+    session["sources"][sid] = {
+        "fingerprint": fingerprint,
+        "name": name or os.path.basename(file_path),
+        "path": os.path.abspath(file_path) if keep_path else None,
+        "sample_rate": int(sr),
+        "mono": mono,
+        "decoded": decoded_name,
+    }
+    return sid, audio_array, sr
+
+
+def set_window(session: dict, name: str, sid: str, start_time: float, end_time: float,
+               slowdown_factor: float, semitones: float = 0.0) -> None:
+    """
+    Creates or updates a named loop window and makes it the active one.
+
+    :param dict session: The session to update.
+    :param str name: Name of the loop window.
+    :param str sid: Id of the source the window belongs to (as returned by add_source).
+    :param float start_time: Start time in seconds.
+    :param float end_time: End time in seconds.
+    :param float slowdown_factor: The slowdown factor for the window.
+    :param float semitones: The pitch shift for the window, in semitones.
+
+    :return: None
+    """
+    if sid not in session["sources"]:
+        raise ValueError(f"Unknown source {sid}; add it to the session first.")
+    window = {
+        "source": sid,
+        "start": float(start_time),
+        "end": float(end_time),
+        "factor": float(slowdown_factor),
+        "semitones": float(semitones),
+    }
+    window["rendered"] = _rendered_name(session["sources"][sid], window)
+    session["windows"][name] = window
+    session["active_window"] = name
+
+
+def _rendered_name(source: dict, window: dict) -> str:
+    key = render_key(source["fingerprint"], window["start"], window["end"], window["factor"],
+                     mono=source["mono"], semitones=window["semitones"])
+    return f"{key}.npy"
+
+
+def _sanitize_session(session: dict) -> None:
+    # Session files may come from untrusted clients: every buffer name is derived again from the
+    # parameters it stands for, so a session can only ever reach the buffers it describes
+    for sid, source in list(session["sources"].items()):
+        fingerprint = source.get("fingerprint")
+        valid = (isinstance(fingerprint, str) and re.fullmatch(r"[0-9a-f]{64}", fingerprint) is not None
+                 and isinstance(source.get("mono"), bool) and isinstance(source.get("sample_rate"), int)
+                 and source["sample_rate"] > 0 and sid == source_id(fingerprint, source["mono"]))
+        if not valid:
+            print(f"Dropping invalid source {sid} from the session.")
+            del session["sources"][sid]
+            continue
+        source["decoded"] = _decoded_name(fingerprint, source["mono"], source["sample_rate"])
+    for name, window in list(session["windows"].items()):
+        try:
+            window = {
+                "source": window["source"],
+                "start": float(window["start"]),
+                "end": float(window["end"]),
+                "factor": float(window["factor"]),
+                "semitones": float(window.get("semitones", 0.0)),
+            }
+        except (KeyError, TypeError, ValueError):
+            window = None
+        if window is None or window["source"] not in session["sources"]:
+            print(f"Dropping invalid window {name} from the session.")
+            del session["windows"][name]
+            continue
+        window["rendered"] = _rendered_name(session["sources"][window["source"]], window)
+        session["windows"][name] = window
+    if session.get("active_window") not in session["windows"]:
+        session["active_window"] = None
+
+
+def window_render_key(session: dict, name: str) -> str:
+    """
+    Returns the render key of a named window, e.g. to cache encodings of its rendered audio.
+    The key is derived from the window's parameters, never read back from stored names.
+
+    :param dict session: The session holding the window.
+    :param str name: Name of the loop window.
+
+    :return: Hex digest identifying the window's rendered segment (see render_key).
+    """
+    window = session["windows"][name]
+    return os.path.splitext(_rendered_name(session["sources"][window["source"]], window))[0]
+
+
+def _window_analysis(window: dict, segment: np.ndarray) -> np.ndarray:
+    # The source id includes the channel layout, so it fully identifies the analysed segment
+    key = (window["source"], window["start"], window["end"])
+    with _analysis_cache_lock:
+        if key in _analysis_cache:
+            _analysis_cache.move_to_end(key)
+            return _analysis_cache[key]
+    stft_matrix = analyze_audio(segment)
+    if stft_matrix.nbytes > ANALYSIS_CACHE_BYTES:
+        return stft_matrix
+    with _analysis_cache_lock:
+        _analysis_cache[key] = stft_matrix
+        total = sum(cached.nbytes for cached in _analysis_cache.values())
+        while total > ANALYSIS_CACHE_BYTES:
+            _, evicted = _analysis_cache.popitem(last=False)
+            total -= evicted.nbytes
+    return stft_matrix
+
+
+def render_window(session: dict, name: str, audio_array: np.ndarray, sr: int) -> np.ndarray:
+    """
+    Returns the rendered audio of a named window, memory-mapping it from the cache when present
+    and rendering (then caching) it otherwise. Renders of the same time window reuse its STFT analysis.
+
+    :param dict session: The session holding the window.
+    :param str name: Name of the loop window.
+    :param np.ndarray audio_array: Decoded samples of the window's source (None if the source is missing,
+                                   in which case only a cached render can be returned).
+    :param int sr: Sample rate of audio_array.
+
+    :return: NumPy array of the rendered segment.
+    """
+    window = session["windows"][name]
+    rendered_path = _cache_path(session, window["rendered"])
+    rendered = _load_buffer(rendered_path)
+    if rendered is not None:
+        return rendered
+    if audio_array is None:
+        raise FileNotFoundError(f"Window {name} is not cached and its source is missing.")
+    segment = extract_time_window(audio_array, sr, window["start"], window["end"])
+    semitones = window.get("semitones", 0.0)
+    if window["factor"] != 1.0 or semitones != 0.0:
+        rendered = slow_down_and_transpose(segment, sr, window["factor"], semitones,
+                                           stft_matrix=_window_analysis(window, segment))
+    else:
+        # Nothing to render: the segment is a cheap slice of the source, so it is not cached
+        return segment
+    _save_buffer(rendered_path, rendered)
+    return rendered
+
+
+def save_session(session: dict, session_path: str) -> None:
+    """
+    Writes the session to a JSON file. Cached buffers stay in the session's cache directory.
+
+    :param dict session: The session to save.
+    :param str session_path: Path to the session file.
+
+    :return: None
+    """
+    print(f"Saving session to {session_path}...")
+    _replace_atomically(session_path, lambda f: f.write(session_to_json(session)), mode="w")
+
+
+def session_to_json(session: dict) -> str:
+    """
+    Serializes a session to JSON text, e.g. to offer it for download instead of writing it to disk.
+
+    :param dict session: The session to serialize.
+
+    :return: The session as a JSON string.
+    """
+    return json.dumps(session, indent=2)
+
+
+def restore_session(session_json: str, cache_dir: str = None, decode_missing: bool = True):
+    """
+    Restores the sources of a serialized session. Decoded buffers still in the cache are
+    memory-mapped; missing ones are decoded again from the source file, provided its fingerprint
+    still matches. Sources that cannot be restored are flagged as "missing" and left out of the
+    returned audio; their cached windows can still be played. Rendered windows are restored lazily
+    through render_window. Buffer names are recomputed from the sources' and windows' parameters,
+    and inconsistent entries are dropped.
+
+    :param str session_json: The session as JSON text (see session_to_json).
+    :param str cache_dir: Cache directory to use instead of the one recorded in the session
+                          (required when the session comes from an untrusted client).
+    :param bool decode_missing: If False, source paths recorded in the session are never read,
+                                so only cached buffers are restored.
+
+    :return: Tuple (session, audio) where audio maps each source id to (audio_array, sample_rate).
+    """
+    session = json.loads(session_json)
+    if session.get("version") != SESSION_VERSION:
+        raise ValueError(f"Unsupported session version: {session.get('version')}")
+    _sanitize_session(session)
+    if cache_dir is not None:
+        session["cache_dir"] = os.path.abspath(cache_dir)
+    os.makedirs(session["cache_dir"], exist_ok=True)
+
+    audio = {}
+    for sid, source in session["sources"].items():
+        audio_array = _load_buffer(_cache_path(session, source["decoded"]))
+        if audio_array is None:
+            path = source.get("path")
+            if (not decode_missing or path is None or not os.path.exists(path)
+                    or file_fingerprint(path) != source["fingerprint"]):
+                print(f"Source {source.get('name', path)} is missing or has changed and no cached copy exists.")
+                source["missing"] = True
+                continue
+            audio_array, sr = decode_source(path, mono=source["mono"])
+            source["decoded"] = _decoded_name(source["fingerprint"], source["mono"], sr)
+            source["sample_rate"] = int(sr)
+            _save_buffer(_cache_path(session, source["decoded"]), audio_array)
+        source["missing"] = False
+        audio[sid] = (audio_array, source["sample_rate"])
+    return session, audio
+
+
+def open_session(session_path: str):
+    """
+    Reads a session file and restores its sources (see restore_session).
+
+    :param str session_path: Path to the session file.
+
+    :return: Tuple (session, audio) where audio maps each source id to (audio_array, sample_rate).
+    """
+    print(f"Opening session {session_path}...")
+    with open(session_path) as f:
+        return restore_session(f.read())
@@ -2,10 +2,9 @@ import streamlit as st
 import os
 import numpy as np
 import librosa
-import sounddevice as sd
-import threading
-import time
-from slowdowner.audio import load_audio, extract_audio_from_video, extract_time_window, slow_down_audio
+from slowdowner.audio import audio_duration, encode_audio, AUDIO_FORMATS
+from slowdowner.session import (new_session, add_source, set_window, render_window, window_render_key,
+                                session_to_json, restore_session, DEFAULT_CACHE_DIR)
 import tempfile
 import io
 
@@ -18,47 +17,80 @@ def initialize_session_state():
         st.session_state.sample_rate = None
     if 'audio_duration' not in st.session_state:
         st.session_state.audio_duration = 0
-    if 'is_playing' not in st.session_state:
-        st.session_state.is_playing = False
-    if 'current_loop' not in st.session_state:
-        st.session_state.current_loop = 0
-    if 'playback_thread' not in st.session_state:
-        st.session_state.playback_thread = None
     if 'processed_audio' not in st.session_state:
         st.session_state.processed_audio = None
+    if 'processed_window' not in st.session_state:
+        st.session_state.processed_window = None
+    if 'processed_key' not in st.session_state:
+        st.session_state.processed_key = None
+    if 'processed_sample_rate' not in st.session_state:
+        st.session_state.processed_sample_rate = None
+    if 'practice_session' not in st.session_state:
+        st.session_state.practice_session = new_session()
+    if 'source_id' not in st.session_state:
+        st.session_state.source_id = None
+    if 'uploaded_source' not in st.session_state:
+        st.session_state.uploaded_source = None
+    if 'session_file_id' not in st.session_state:
+        st.session_state.session_file_id = None
+    if 'window_defaults' not in st.session_state:
+        st.session_state.window_defaults = {
+            "name": "Loop 1", "start": 0.0, "end": 5.0, "factor": 2.0, "semitones": 0.0
+        }
 
 
-def stop_playback():
-    """Stop any ongoing playback"""
-    st.session_state.is_playing = False
-    try:
-        sd.stop()
-    except:
-        pass
-
-
-def play_audio_segment(audio_segment, sample_rate, num_loops):
-    """Play audio segment in a separate thread"""
-    try:
-        for loop_num in range(1, num_loops + 1 if num_loops > 0 else float('inf')):
-            if not st.session_state.is_playing:
-                break
-            
-            st.session_state.current_loop = loop_num
-            sd.play(audio_segment, sample_rate)
-            sd.wait()
-            
-            # Small delay between loops
-            time.sleep(0.1)
-            
-            # Break if finite loops
-            if num_loops > 0 and loop_num >= num_loops:
-                break
-                
-    except Exception as e:
-        st.error(f"Playback error: {str(e)}")
-    finally:
-        st.session_state.is_playing = False
+def restore_practice_session(session_json):
+    """Restore an uploaded practice session, load its active window into the controls
+    and return the names of the sources that could not be restored"""
+    # Session files come from remote users: keep the server's cache directory and never read their paths
+    session, audio = restore_session(session_json, cache_dir=DEFAULT_CACHE_DIR, decode_missing=False)
+    st.session_state.practice_session = session
+    
+    st.session_state.processed_audio = None
+    st.session_state.processed_window = None
+    st.session_state.processed_key = None
+    st.session_state.processed_sample_rate = None
+    
+    sid = None
+    window = session["windows"].get(session["active_window"])
+    if window is not None:
+        if window["source"] in audio:
+            sid = window["source"]
+        st.session_state.window_defaults = {
+            "name": session["active_window"],
+            "start": window["start"],
+            "end": window["end"],
+            "factor": window["factor"],
+            "semitones": window.get("semitones", 0.0),
+        }
+    if sid is None and audio:
+        sid = next(iter(audio))
+    
+    if sid is not None:
+        audio_data, sample_rate = audio[sid]
+        st.session_state.source_id = sid
+        st.session_state.audio_data = audio_data
+        st.session_state.sample_rate = sample_rate
+        st.session_state.audio_duration = audio_duration(audio_data, sample_rate)
+    else:
+        st.session_state.source_id = None
+        st.session_state.audio_data = None
+    if window is not None:
+        # A cached render stays playable even when its source could not be restored
+        # The processed audio keeps its own rate: its source may be missing and differ from the loaded one
+        source_audio, sample_rate = audio.get(
+            window["source"], (None, session["sources"][window["source"]]["sample_rate"])
+        )
+        try:
+            processed_segment = render_window(session, session["active_window"], source_audio, sample_rate)
+            st.session_state.processed_audio = processed_segment
+            st.session_state.processed_window = session["active_window"]
+            st.session_state.processed_key = window_render_key(session, session["active_window"])
+            st.session_state.processed_sample_rate = sample_rate
+        except FileNotFoundError:
+            pass
+    
+    return [source["name"] for source in session["sources"].values() if source.get("missing")]
 
 
 def main():
@@ -78,6 +110,26 @@ def main():
     with st.sidebar:
         st.header("⚙️ Controls")
         
+        # Practice session
+        st.subheader("💾 Practice Session")
+        session_file = st.file_uploader(
+            "Open a session file",
+            type=['json'],
+            help="Session saved earlier with the Save Session button"
+        )
+        
+        # Restore only when a new session file is uploaded, not on every rerun
+        if session_file is not None and session_file.file_id != st.session_state.session_file_id:
+            st.session_state.session_file_id = session_file.file_id
+            try:
+                with st.spinner("Opening session..."):
+                    missing = restore_practice_session(session_file.getvalue().decode("utf-8"))
+                st.success(f"✅ Session opened: {session_file.name}")
+                if missing:
+                    st.warning(f"Not in the cache anymore, upload again to edit: {', '.join(missing)}")
+            except Exception as e:
+                st.error(f"Error opening session: {str(e)}")
+        
         # File upload
         st.subheader("📁 Load Audio File")
         uploaded_file = st.file_uploader(
@@ -85,8 +137,13 @@ def main():
             type=['wav', 'mp3', 'flac', 'aac', 'ogg', 'mp4', 'mov', 'avi', 'mkv'],
             help="Upload audio or video files"
         )
+        mono = st.checkbox("Mono (faster processing)", value=False,
+                           help="Downmix to mono; leave unchecked to keep the original channels")
         
-        if uploaded_file is not None:
+        # Load only when the upload (or its channel setting) changed, so reruns and restored
+        # sessions are not overridden by a file still sitting in the uploader
+        if uploaded_file is not None and (uploaded_file.file_id, mono) != st.session_state.uploaded_source:
+            st.session_state.uploaded_source = (uploaded_file.file_id, mono)
             try:
                 with st.spinner("Loading audio file..."):
                     # Save uploaded file temporarily
@@ -95,19 +152,22 @@ def main():
                         tmp_file.write(uploaded_file.read())
                         tmp_path = tmp_file.name
                     
-                    # Load audio based on file type
-                    if uploaded_file.name.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
-                        audio_data, sample_rate = extract_audio_from_video(tmp_path)
-                    else:
-                        audio_data, sample_rate = load_audio(tmp_path)
-                    
-                    # Clean up temp file
-                    os.unlink(tmp_path)
+                    # Load audio (decoded samples are cached, so reruns memory-map them). The temp
+                    # file is deleted right away, so only the upload's name goes into the session
+                    try:
+                        sid, audio_data, sample_rate = add_source(
+                            st.session_state.practice_session, tmp_path, mono=mono,
+                            name=uploaded_file.name, keep_path=False
+                        )
+                    finally:
+                        # Clean up temp file
+                        os.unlink(tmp_path)
                     
                     # Store in session state
+                    st.session_state.source_id = sid
                     st.session_state.audio_data = audio_data
                     st.session_state.sample_rate = sample_rate
-                    st.session_state.audio_duration = len(audio_data) / sample_rate
+                    st.session_state.audio_duration = audio_duration(audio_data, sample_rate)
                     
                     st.success(f"✅ Loaded: {uploaded_file.name}")
                     st.info(f"Duration: {st.session_state.audio_duration:.2f} seconds")
@@ -118,6 +178,9 @@ def main():
         # Audio controls (only show if audio is loaded)
         if st.session_state.audio_data is not None:
             st.subheader("⏰ Time Window")
+            defaults = st.session_state.window_defaults
+            
+            window_name = st.text_input("Loop Name", value=defaults["name"])
             
             # Time inputs with validation
             col1, col2 = st.columns(2)
@@ -126,7 +189,7 @@ def main():
                     "Start (s)", 
                     min_value=0.0, 
                     max_value=max(0.0, st.session_state.audio_duration - 0.1),
-                    value=0.0,
+                    value=min(defaults["start"], max(0.0, st.session_state.audio_duration - 0.1)),
                     step=0.1,
                     format="%.1f"
                 )
@@ -136,7 +199,7 @@ def main():
                     "End (s)", 
                     min_value=start_time + 0.1, 
                     max_value=st.session_state.audio_duration,
-                    value=min(5.0, st.session_state.audio_duration),
+                    value=max(start_time + 0.1, min(defaults["end"], st.session_state.audio_duration)),
                     step=0.1,
                     format="%.1f"
                 )
@@ -164,44 +227,61 @@ def main():
                 "Slowdown Factor",
                 min_value=0.1,
                 max_value=10.0,
-                value=2.0,
+                value=defaults["factor"],
                 step=0.1,
                 help="1.0 = normal speed, 2.0 = half speed, 0.5 = double speed"
             )
             
-            # Loop control
-            num_loops = st.number_input(
-                "Number of Loops",
-                min_value=0,
-                max_value=1000,
-                value=1,
-                step=1,
-                help="0 = infinite loops"
+            # Pitch control
+            semitones = st.number_input(
+                "Transpose (semitones)",
+                min_value=-12.0,
+                max_value=12.0,
+                value=defaults["semitones"],
+                step=0.5,
+                help="Shift the pitch, e.g. -2.0 = a whole tone down (applied in the same pass as the slowdown)"
             )
             
             # Process audio button
             if st.button("🔄 Process Audio", type="primary"):
                 try:
                     with st.spinner("Processing audio..."):
-                        # Extract time window
-                        audio_segment = extract_time_window(
-                            st.session_state.audio_data,
-                            st.session_state.sample_rate,
+                        # Extract time window, apply slowdown and transposition (reusing the cached render if any)
+                        name = window_name.strip() or "Loop 1"
+                        set_window(
+                            st.session_state.practice_session,
+                            name,
+                            st.session_state.source_id,
                             start_time,
-                            end_time
+                            end_time,
+                            slowdown_factor,
+                            semitones
+                        )
+                        processed_segment = render_window(
+                            st.session_state.practice_session,
+                            name,
+                            st.session_state.audio_data,
+                            st.session_state.sample_rate
                         )
                         
-                        # Apply slowdown
-                        if slowdown_factor != 1.0:
-                            processed_segment = slow_down_audio(audio_segment, slowdown_factor)
-                        else:
-                            processed_segment = audio_segment
-                        
+                        # Only record the render key once rendering succeeded, so it always matches processed_audio
                         st.session_state.processed_audio = processed_segment
+                        st.session_state.processed_window = name
+                        st.session_state.processed_key = window_render_key(st.session_state.practice_session, name)
+                        st.session_state.processed_sample_rate = st.session_state.sample_rate
                         st.success("✅ Audio processed successfully!")
                         
                 except Exception as e:
                     st.error(f"Processing error: {str(e)}")
+        
+        # Saved last so the download reflects changes made in this run
+        st.download_button(
+            "💾 Save Session",
+            data=session_to_json(st.session_state.practice_session),
+            file_name="slowdowner_session.json",
+            mime="application/json",
+            use_container_width=True
+        )
     
     # Main content area
     col1, col2 = st.columns([2, 1])
@@ -218,16 +298,16 @@ def main():
                 st.metric("Sample Rate", f"{st.session_state.sample_rate} Hz")
             with info_col3:
                 if st.session_state.processed_audio is not None:
-                    processed_duration = len(st.session_state.processed_audio) / st.session_state.sample_rate
+                    processed_duration = audio_duration(st.session_state.processed_audio, st.session_state.processed_sample_rate)
                     st.metric("Processed Length", f"{processed_duration:.2f} s")
             
             # Waveform visualization (simplified)
             if st.session_state.processed_audio is not None:
                 st.subheader("📊 Processed Audio Waveform")
                 
-                # Downsample for visualization
-                downsample_factor = max(1, len(st.session_state.processed_audio) // 1000)
-                viz_audio = st.session_state.processed_audio[::downsample_factor]
+                # Downsample for visualization (one line per channel)
+                downsample_factor = max(1, st.session_state.processed_audio.shape[-1] // 1000)
+                viz_audio = st.session_state.processed_audio[..., ::downsample_factor].T
                 
                 st.line_chart(viz_audio[:1000])  # Limit to first 1000 samples for performance
         else:
@@ -237,41 +317,39 @@ def main():
         if st.session_state.processed_audio is not None:
             st.subheader("🎮 Playback Controls")
             
-            # Control buttons
-            col_play, col_stop = st.columns(2)
-            
-            with col_play:
-                if not st.session_state.is_playing:
-                    if st.button("▶️ Play", type="primary", use_container_width=True):
-                        st.session_state.is_playing = True
-                        st.session_state.current_loop = 0
-                        
-                        # Start playback in thread
-                        playback_thread = threading.Thread(
-                            target=play_audio_segment,
-                            args=(st.session_state.processed_audio, st.session_state.sample_rate, num_loops),
-                            daemon=True
-                        )
-                        playback_thread.start()
-                        st.rerun()
-                else:
-                    st.button("⏸️ Playing...", disabled=True, use_container_width=True)
-            
-            with col_stop:
-                if st.button("⏹️ Stop", use_container_width=True):
-                    stop_playback()
-                    st.rerun()
+            audio_format = st.selectbox(
+                "Format",
+                list(AUDIO_FORMATS),
+                format_func=str.upper,
+                help="WAV is lossless and fastest to encode, FLAC is lossless and smaller, OGG is smallest"
+            )
+            loop_playback = st.checkbox(
+                "Loop playback",
+                value=True,
+                help="Repeat the processed segment in the browser player until paused"
+            )
             
-            # Status display
-            if st.session_state.is_playing:
-                if num_loops == 0:
-                    st.success(f"🔄 Playing loop {st.session_state.current_loop} (infinite)")
-                else:
-                    progress = min(st.session_state.current_loop / num_loops, 1.0) if num_loops > 0 else 0
-                    st.success(f"🔄 Playing loop {st.session_state.current_loop} of {num_loops}")
-                    st.progress(progress)
-            elif st.session_state.processed_audio is not None:
-                st.info("⏹️ Ready to play")
+            # Encode in memory (cached per render and format) and stream to the browser
+            try:
+                name = st.session_state.processed_window
+                encoded = encode_audio(
+                    st.session_state.processed_audio,
+                    st.session_state.processed_sample_rate,
+                    audio_format,
+                    cache_key=st.session_state.processed_key
+                )
+                mime_type = AUDIO_FORMATS[audio_format][1]
+                
+                st.audio(encoded, format=mime_type, loop=loop_playback)
+                st.download_button(
+                    "⬇️ Download",
+                    data=encoded,
+                    file_name=f"{name}.{audio_format}",
+                    mime=mime_type,
+                    use_container_width=True
+                )
+            except Exception as e:
+                st.error(f"Encoding error: {str(e)}")
     
     # Footer
     st.markdown("---")
@@ -280,9 +358,9 @@ def main():
         **Tips:**
         - 🎵 Supports audio formats: WAV, MP3, FLAC, AAC, OGG
         - 🎬 Supports video formats: MP4, MOV, AVI, MKV (extracts audio)
-        - ⚡ Process audio first, then use playback controls
-        - 🔄 Set loops to 0 for infinite playback
-        - ⏹️ Use Stop button to halt infinite loops
+        - ⚡ Process audio first, then play it in the browser player
+        - 🔄 Enable "Loop playback" to repeat the segment
+        - ⬇️ Download the processed segment as WAV, FLAC or OGG
         """
     )
 
@@ -0,0 +1,97 @@
+import io
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+from slowdowner import audio
+from slowdowner.audio import render_key, extract_time_window, slow_down_audio, slow_down_and_transpose, analyze_audio
+
+SR = 22050
+FINGERPRINT = "0" * 64
+
+
+def _noise(shape):
+    return (0.1 * np.random.default_rng(0).standard_normal(shape)).astype(np.float32)
+
+
+def test_render_key_depends_on_mono():
+    assert render_key(FINGERPRINT, 1.0, 2.0, 1.5) != render_key(FINGERPRINT, 1.0, 2.0, 1.5, mono=True)
+    assert render_key(FINGERPRINT, 1.0, 2.0, 1.5) == render_key(FINGERPRINT, 1.0, 2.0, 1.5, mono=False)
+
+
+def test_multichannel_window_and_stretch_keep_channels():
+    segment = extract_time_window(_noise((2, SR * 2)), SR, 0.5, 1.5)
+    assert segment.shape == (2, SR)
+    stretched = slow_down_audio(segment, 2.0)
+    assert stretched.shape == (2, 2 * SR)
+
+
+def test_render_key_depends_on_semitones():
+    assert render_key(FINGERPRINT, 1.0, 2.0, 1.5) != render_key(FINGERPRINT, 1.0, 2.0, 1.5, semitones=-2.0)
+
+
+@pytest.mark.parametrize("shape", [(SR,), (2, SR)])
+@pytest.mark.parametrize("slowdown_factor,semitones", [(2.0, 0.0), (1.5, -2.0), (0.5, 3.0)])
+def test_slow_down_and_transpose_shape(shape, slowdown_factor, semitones):
+    y = _noise(shape)
+    out = slow_down_and_transpose(y, SR, slowdown_factor, semitones)
+    assert out.shape == shape[:-1] + (int(round(SR * slowdown_factor)),)
+    assert out.dtype == y.dtype
+
+
+def test_slow_down_and_transpose_without_shift_matches_time_stretch():
+    y = _noise((2, SR))
+    expected = librosa.effects.time_stretch(y, rate=1.0 / 2.0)
+    np.testing.assert_allclose(slow_down_and_transpose(y, SR, 2.0), expected, atol=1e-5)
+
+
+def test_slow_down_and_transpose_reuses_analysis():
+    y = _noise(SR)
+    stft_matrix = analyze_audio(y)
+    np.testing.assert_allclose(slow_down_and_transpose(y, SR, 1.5, -2.0, stft_matrix=stft_matrix),
+                               slow_down_and_transpose(y, SR, 1.5, -2.0), atol=1e-6)
+
+
+def test_slow_down_and_transpose_shifts_pitch():
+    t = np.arange(SR) / SR
+    tone = np.sin(2 * np.pi * 440.0 * t).astype(np.float32)
+    out = slow_down_and_transpose(tone, SR, 2.0, -12.0)
+    spectrum = np.abs(np.fft.rfft(out))
+    assert np.argmax(spectrum) * SR / len(out) == pytest.approx(220.0, abs=2.0)
+
+
+@pytest.mark.parametrize("audio_format", ["wav", "flac", "ogg"])
+def test_encode_audio_round_trip(audio_format):
+    y = _noise((2, SR))
+    data, sr = sf.read(io.BytesIO(audio.encode_audio(y, SR, audio_format)), always_2d=True)
+    assert sr == SR
+    assert data.shape == (SR, 2)
+    if audio_format != "ogg":
+        np.testing.assert_allclose(data.T, y, atol=1e-4)
+
+
+def test_encode_audio_cache_hit(monkeypatch):
+    monkeypatch.setattr(audio, "_encode_cache", type(audio._encode_cache)())
+    y = _noise(SR)
+    first = audio.encode_audio(y, SR, "flac", cache_key="key")
+    assert audio.encode_audio(np.zeros(SR, dtype=np.float32), SR, "flac", cache_key="key") is first
+    assert audio.encode_audio(y, SR, "wav", cache_key="key") is not first
+
+
+def test_encode_audio_cache_evicts_by_size(monkeypatch):
+    monkeypatch.setattr(audio, "_encode_cache", type(audio._encode_cache)())
+    y = _noise(SR)
+    size = len(audio.encode_audio(y, SR, "wav"))
+    monkeypatch.setattr(audio, "ENCODE_CACHE_BYTES", 2 * size)
+    for key in ("a", "b", "c"):
+        audio.encode_audio(y, SR, "wav", cache_key=key)
+    assert list(audio._encode_cache) == [("b", "wav"), ("c", "wav")]
+
+    monkeypatch.setattr(audio, "ENCODE_CACHE_BYTES", size - 1)
+    audio.encode_audio(y, SR, "wav", cache_key="d")
+    assert ("d", "wav") not in audio._encode_cache
+
+
+def test_encode_audio_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        audio.encode_audio(_noise(SR), SR, "mp3")
@@ -0,0 +1,158 @@
+import os
+import numpy as np
+import pytest
+import soundfile as sf
+from slowdowner import session as sess
+
+SR = 22050
+
+
+@pytest.fixture
+def audio_file(tmp_path):
+    rng = np.random.default_rng(0)
+    path = tmp_path / "source.wav"
+    sf.write(path, (0.1 * rng.standard_normal((SR * 3, 2))).astype(np.float32), SR)
+    return str(path)
+
+
+@pytest.fixture
+def session(tmp_path):
+    return sess.new_session(str(tmp_path / "cache"))
+
+
+def _no_decode(*args, **kwargs):
+    raise AssertionError("source was decoded again")
+
+
+def test_save_open_round_trip(tmp_path, session, audio_file):
+    sid, audio_array, sr = sess.add_source(session, audio_file)
+    sess.set_window(session, "verse", sid, 0.5, 1.5, 2.0, semitones=-2.0)
+    rendered = sess.render_window(session, "verse", audio_array, sr)
+    session_path = str(tmp_path / "practice.json")
+    sess.save_session(session, session_path)
+
+    restored, audio = sess.open_session(session_path)
+    assert restored["windows"] == session["windows"]
+    assert restored["active_window"] == "verse"
+    restored_array, restored_sr = audio[sid]
+    assert restored_sr == SR
+    assert isinstance(restored_array, np.memmap)
+    np.testing.assert_array_equal(restored_array, audio_array)
+
+    restored_render = sess.render_window(restored, "verse", None, restored_sr)
+    assert isinstance(restored_render, np.memmap)
+    np.testing.assert_array_equal(restored_render, rendered)
+    assert not [name for name in os.listdir(session["cache_dir"]) if name.endswith(".tmp")]
+
+
+def test_fresh_session_reuses_cached_source(monkeypatch, session, audio_file):
+    sess.add_source(session, audio_file)
+    monkeypatch.setattr(sess, "decode_source", _no_decode)
+    sid, audio_array, sr = sess.add_source(sess.new_session(session["cache_dir"]), audio_file)
+    assert isinstance(audio_array, np.memmap)
+    assert sr == SR
+
+
+def test_missing_render_is_recomputed(session, audio_file):
+    sid, audio_array, sr = sess.add_source(session, audio_file)
+    sess.set_window(session, "verse", sid, 0.5, 1.5, 1.5)
+    rendered = sess.render_window(session, "verse", audio_array, sr)
+    os.remove(os.path.join(session["cache_dir"], session["windows"]["verse"]["rendered"]))
+
+    restored, audio = sess.restore_session(sess.session_to_json(session))
+    np.testing.assert_allclose(sess.render_window(restored, "verse", *audio[sid]), rendered)
+
+
+def test_missing_buffer_is_decoded_from_source(session, audio_file):
+    sid, audio_array, sr = sess.add_source(session, audio_file)
+    os.remove(os.path.join(session["cache_dir"], session["sources"][sid]["decoded"]))
+
+    restored, audio = sess.restore_session(sess.session_to_json(session))
+    assert not restored["sources"][sid]["missing"]
+    np.testing.assert_array_equal(audio[sid][0], audio_array)
+    assert os.path.exists(os.path.join(session["cache_dir"], restored["sources"][sid]["decoded"]))
+
+
+def test_missing_source_is_flagged(session, audio_file):
+    sid, audio_array, sr = sess.add_source(session, audio_file, keep_path=False)
+    sess.set_window(session, "verse", sid, 0.5, 1.5, 1.5)
+    rendered = sess.render_window(session, "verse", audio_array, sr)
+    sess.set_window(session, "chorus", sid, 1.5, 2.5, 1.5)
+    os.remove(os.path.join(session["cache_dir"], session["sources"][sid]["decoded"]))
+
+    restored, audio = sess.restore_session(sess.session_to_json(session))
+    assert sid not in audio
+    assert restored["sources"][sid]["missing"]
+    np.testing.assert_array_equal(sess.render_window(restored, "verse", None, sr), rendered)
+    with pytest.raises(FileNotFoundError):
+        sess.render_window(restored, "chorus", None, sr)
+
+
+def test_untrusted_session_never_reads_source_paths(monkeypatch, tmp_path, session, audio_file):
+    sid, _, _ = sess.add_source(session, audio_file)
+    monkeypatch.setattr(sess, "decode_source", _no_decode)
+    other_cache = str(tmp_path / "server_cache")
+
+    restored, audio = sess.restore_session(sess.session_to_json(session), cache_dir=other_cache,
+                                           decode_missing=False)
+    assert restored["cache_dir"] == os.path.abspath(other_cache)
+    assert restored["sources"][sid]["missing"]
+    assert audio == {}
+
+
+def test_mono_and_native_sources_are_separate(session, audio_file):
+    native_id, native, sr = sess.add_source(session, audio_file)
+    mono_id, mono, _ = sess.add_source(session, audio_file, mono=True)
+    assert native_id != mono_id
+    sess.set_window(session, "native", native_id, 0.5, 1.5, 1.5)
+    sess.set_window(session, "mono", mono_id, 0.5, 1.5, 1.5)
+    assert session["windows"]["native"]["rendered"] != session["windows"]["mono"]["rendered"]
+    assert sess.render_window(session, "native", native, sr).ndim == 2
+    assert sess.render_window(session, "mono", mono, sr).ndim == 1
+
+
+def test_identity_render_is_not_cached(session, audio_file):
+    sid, audio_array, sr = sess.add_source(session, audio_file)
+    sess.set_window(session, "verse", sid, 0.5, 1.5, 1.0)
+    rendered = sess.render_window(session, "verse", audio_array, sr)
+    assert rendered.shape == (2, SR)
+    assert not os.path.exists(os.path.join(session["cache_dir"], session["windows"]["verse"]["rendered"]))
+
+
+def test_cache_evicts_least_recently_used(monkeypatch, tmp_path):
+    buffer = np.zeros(1000, dtype=np.float32)
+    paths = [str(tmp_path / f"{i}.npy") for i in range(5)]
+    for i, path in enumerate(paths):
+        np.save(path, buffer)
+        os.utime(path, (i, i))
+    sess._load_buffer(paths[0])
+    monkeypatch.setattr(sess, "CACHE_SIZE_LIMIT", 3 * os.path.getsize(paths[0]))
+    sess._save_buffer(str(tmp_path / "new.npy"), buffer)
+    assert sorted(os.listdir(tmp_path)) == ["0.npy", "4.npy", "new.npy"]
+
+
+def test_tampered_session_cannot_reach_other_buffers(tmp_path, session, audio_file):
+    sid, audio_array, sr = sess.add_source(session, audio_file)
+    sess.set_window(session, "verse", sid, 0.0, 1.0, 2.0)
+    rendered = sess.render_window(session, "verse", audio_array, sr)
+
+    silent_file = str(tmp_path / "silent.wav")
+    sf.write(silent_file, np.zeros((SR * 2, 2), dtype=np.float32), SR)
+    attacker = sess.new_session(session["cache_dir"])
+    silent_id, _, _ = sess.add_source(attacker, silent_file)
+    sess.set_window(attacker, "verse", silent_id, 0.0, 1.0, 2.0)
+    attacker["windows"]["verse"]["rendered"] = session["windows"]["verse"]["rendered"]
+    attacker["sources"][silent_id]["decoded"] = session["sources"][sid]["decoded"]
+    attacker["sources"]["bogus"] = dict(session["sources"][sid])
+    attacker["windows"]["orphan"] = dict(session["windows"]["verse"], source="bogus")
+    os.remove(os.path.join(session["cache_dir"], sess._decoded_name(
+        attacker["sources"][silent_id]["fingerprint"], False, SR)))
+
+    restored, audio = sess.restore_session(sess.session_to_json(attacker), cache_dir=session["cache_dir"],
+                                           decode_missing=False)
+    assert "bogus" not in restored["sources"] and "orphan" not in restored["windows"]
+    assert silent_id not in audio
+    assert restored["windows"]["verse"]["rendered"] != session["windows"]["verse"]["rendered"]
+    with pytest.raises(FileNotFoundError):
+        sess.render_window(restored, "verse", None, sr)
+    np.testing.assert_array_equal(sess.render_window(session, "verse", audio_array, sr), rendered)